@@ -6,10 +6,16 @@ build_database.py - 三级精度差异化构建器
 层级3: 其余所有 - 低精度 (超级合并为‘ZZ’)
 """
 
-import csv, json, os, shutil, sys
+import base64, csv, io, os, shutil, socket, sys, zipfile
+from collections import deque
 from urllib.request import urlopen
-from ipaddress import ip_network
 from datetime import datetime, timezone
+
+import numpy as np
+import orjson
+import pandas as pd
+from mmdb_writer import MMDBWriter
+from netaddr import IPRange, IPSet
 MAXMIND_LICENSE_KEY = os.environ.get("MAXMIND_LICENSE_KEY", "")
 
 # 添加检查，如果密钥为空则报错
@@ -20,8 +26,9 @@ if not MAXMIND_LICENSE_KEY:
     print("   GitHub Actions：已在仓库Secrets中设置")
     sys.exit(1)
 
-OUTPUT_JSON = "database.json"  # 固定文件名，与前端匹配
-TEMP_DIR = "temp_tiered_data"
+OUTPUT_JSON = "database.json"  # 固定文件名，区间数据为紧凑编码 (格式见下方说明)
+OUTPUT_TRIE = "database.trie.bin"  # 前端查找树，与前端匹配
+OUTPUT_MMDB = "database.mmdb"  # MaxMind DB 格式，供 maxminddb/geoip2 等服务端读取
 
 # ====== 三级精度配置 ======
 # 第一层级：核心8国/地区 (高精度，温和合并)
@@ -52,61 +59,271 @@ TIER2_COUNTRIES = {
 
 OTHER_COUNTRY_CODE = 'ZZ'  # 第三层级：其余所有国家
 
+# 各层级的合并阈值 (允许合并的最大间隙)，按 tier_level 下标取值
+MERGE_THRESHOLDS = (
+    None,
+    1,         # 层级1：高精度，只合并直接相邻的
+    262144,    # 层级2：中精度，允许小间隙 (约1024个C类网段)
+    16777216,  # 层级3：低精度，允许超大间隙 (约65536个C类网段)
+)
+
+# 按前缀长度预先计算的主机位掩码: 结束地址 = 起始地址 | HOST_MASKS[前缀长度]
+HOST_MASKS = np.array([(1 << (32 - p)) - 1 for p in range(33)], dtype=np.int64)
+
+# Blocks CSV 中合法的 "a.b.c.d/p" 网段，用于整列预先校验 (主机位是否为0在解析后另行检查)
+_OCTET = r'(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)'  # 不允许前导0 (inet_aton 会按八进制解析)
+NETWORK_PATTERN = rf'{_OCTET}(?:\.{_OCTET}){{3}}/(?:3[0-2]|[12]?\d)'
+
+# 输出使用的国家表 (下标即分组编号)
+COUNTRY_TABLE = sorted(TIER1_COUNTRIES) + sorted(TIER2_COUNTRIES) + [OTHER_COUNTRY_CODE]
+
+# ====== database.json 区间数据 (data) 格式 ======
+# 区间按起始地址升序，三列均为 base64 字符串:
+#   starts:    起始地址与前一区间起始地址之差 (首项与0之差)，LEB128 变长整数
+#   lengths:   结束地址 - 起始地址，LEB128 变长整数
+#   countries: 每区间1字节，为 meta.countries 国家表下标
+# 编码/解码分别见 encode_ranges() / decode_ranges()，构建时写出前会解码校验一次
+
+# ====== 前端查找树 (database.trie.bin) 格式 ======
+# 文件头: b'IPT1' | uint8 根节点分支位数 | uint8 国家数 | 2字节保留 | 每国2字节ASCII代码，补齐到4字节
+# 其后为小端 uint32 槽位数组，每个节点占 2^分支位数 个槽位:
+#   最高位为1 -> 叶子，低31位为 国家表下标+1 (0 表示未知)
+#   否则 -> 位26-30 为子节点分支位数，位0-25 为子节点偏移
+TRIE_MAGIC = b'IPT1'
+TRIE_LEAF = 0x80000000
+TRIE_BRANCH_SHIFT = 26
+TRIE_MAX_BRANCH = 16
+
 def download_and_extract():
-    """下载并提取数据"""
+    """下载数据包并在内存中打开，不写入临时文件"""
     print("[1] 下载数据...")
-    os.makedirs(TEMP_DIR, exist_ok=True)
     download_url = f"https://download.maxmind.com/app/geoip_download?edition_id=GeoLite2-Country-CSV&license_key={MAXMIND_LICENSE_KEY}&suffix=zip"
-    zip_path = os.path.join(TEMP_DIR, "source.zip")
     
     try:
-        with urlopen(download_url) as res, open(zip_path, 'wb') as f:
-            shutil.copyfileobj(res, f)
-        shutil.unpack_archive(zip_path, TEMP_DIR)
-        
-        for item in os.listdir(TEMP_DIR):
-            if item.startswith("GeoLite2-Country-CSV_"):
-                csv_dir = os.path.join(TEMP_DIR, item)
-                return (
-                    os.path.join(csv_dir, "GeoLite2-Country-Blocks-IPv4.csv"),
-                    os.path.join(csv_dir, "GeoLite2-Country-Locations-zh-CN.csv")
-                )
+        buf = io.BytesIO()
+        with urlopen(download_url) as res:
+            shutil.copyfileobj(res, buf)
+        return zipfile.ZipFile(buf)
     except Exception as e:
         print(f"    ❌ 失败: {e}")
         raise Exception(f"下载或解压失败: {e}")
 
-def tiered_merge_ranges(ranges, tier_level):
+def open_member(archive, filename):
+    """按文件名打开压缩包内的CSV (位于 GeoLite2-Country-CSV_<日期>/ 目录下)"""
+    for name in archive.namelist():
+        if name.endswith('/' + filename):
+            return archive.open(name)
+    raise Exception(f"压缩包中未找到 {filename}")
+
+def load_country_map(locations_file):
+    """读取 Locations CSV (二进制文件对象)，返回 geoname_id -> 国家代码 字典"""
+    reader = csv.reader(io.TextIOWrapper(locations_file, encoding='utf-8'))
+    header = next(reader)
+    gid_i = header.index('geoname_id')
+    iso_i = header.index('country_iso_code')
+    return {row[gid_i]: row[iso_i] for row in reader}
+
+def load_blocks(blocks_file, bucket_by_id):
     """
-    根据层级采用不同的合并策略
-    tier_level: 1=高精度, 2=中精度, 3=低精度
+    向量化读取 Blocks-IPv4 CSV
+    bucket_by_id: 以 geoname_id 为下标的 COUNTRY_TABLE 下标数组，-1 表示无国家代码
+    返回 (starts, ends, country_idx) 三个等长数组，已丢弃无国家代码的行
     """
-    if not ranges:
-        return []
+    blocks = pd.read_csv(
+        blocks_file,
+        usecols=['network', 'geoname_id', 'registered_country_geoname_id'],
+        dtype={'network': str},
+    )
     
-    ranges.sort()
-    merged = []
-    cs, ce = ranges[0]
+    # 整列预先校验网段格式，丢弃不合法的行 (无需逐行 try/except)
+    network = blocks['network'].str.strip()
+    valid = network.str.fullmatch(NETWORK_PATTERN, na=False).to_numpy(dtype=bool)
+    if not valid.all():
+        print(f"    跳过 {np.count_nonzero(~valid):,} 个格式不合法的网段")
+        blocks, network = blocks[valid], network[valid]
+    if len(network) == 0:
+        raise Exception("Blocks CSV 中没有有效IP段")
     
-    for s, e in ranges[1:]:
-        if tier_level == 1:
-            # 层级1：高精度，只合并直接相邻的
-            merge_threshold = 1
-        elif tier_level == 2:
-            # 层级2：中精度，允许小间隙 (约1024个C类网段)
-            merge_threshold = 262144
-        else:
-            # 层级3：低精度，允许超大间隙 (约65536个C类网段)
-            merge_threshold = 16777216
+    # 优先使用注册国家，缺失时回退到 geoname_id；之后按整数下标直接取值
+    # 非数字的 id 查不到国家，按 0 处理，最终落到 -1 (无国家代码) 被丢弃
+    gid = blocks['registered_country_geoname_id'].fillna(blocks['geoname_id'])
+    gid = pd.to_numeric(gid, errors='coerce').fillna(0).to_numpy(dtype=np.int64)
+    gid = np.where((gid > 0) & (gid < len(bucket_by_id)), gid, 0)
+    country_idx = bucket_by_id[gid]
+    
+    # 拆分 "a.b.c.d/p"，地址经 inet_aton (C实现) 打包后按大端 uint32 整体解析
+    # 之后用 int64 计算避免 uint32 移位/相减溢出
+    net = network.str.split('/', expand=True)
+    packed = b''.join(map(socket.inet_aton, net[0].tolist()))
+    ips = np.frombuffer(packed, dtype='>u4').astype(np.int64)
+    host_mask = HOST_MASKS[net[1].astype(np.int64).to_numpy()]
+    
+    # 与 ip_network 的严格模式一致：主机位不为0的网段视为不合法并丢弃
+    strict = (ips & host_mask) == 0
+    if not strict.all():
+        print(f"    跳过 {np.count_nonzero(~strict):,} 个主机位不为0的网段")
+    starts = ips
+    ends = starts | host_mask
+    
+    keep = strict & (country_idx >= 0)
+    return starts[keep], ends[keep], country_idx[keep]
+
+def tiered_merge_ranges(starts, ends, group_ids, thresholds):
+    """
+    一次向量化扫描合并所有分组 (国家) 的区间，各分组使用各自的合并阈值
+    starts/ends/group_ids 需已按 (分组, 起始地址) 排序，thresholds 按分组下标给出阈值
+    返回合并后的 (starts, ends, group_ids) 数组
+    """
+    if len(starts) == 0:
+        return starts, ends, group_ids
+    
+    # 每个分组整体平移 2^33：组间间隙必然超过任何阈值，累计最大值也不会跨组
+    offsets = group_ids.astype(np.int64) << 33
+    shifted_starts = starts + offsets
+    
+    # 与此前所有区间的最大结束位置比较，间隙超过阈值即开启新分组
+    cummax_e = np.maximum.accumulate(ends + offsets)
+    new_group = np.empty(len(starts), dtype=bool)
+    new_group[0] = True
+    new_group[1:] = (shifted_starts[1:] - cummax_e[:-1]) > thresholds[group_ids[1:]]
+    
+    group_starts = np.flatnonzero(new_group)
+    merged_ends = np.maximum.reduceat(cummax_e, group_starts) - offsets[group_starts]
+    return starts[group_starts], merged_ends, group_ids[group_starts]
+
+def encode_varints(values):
+    """将非负整数数组 (< 2^35) 向量化编码为 LEB128 变长字节串"""
+    values = values.astype(np.uint64)
+    shifts = np.arange(5, dtype=np.uint64) * np.uint64(7)
+    groups = ((values[:, None] >> shifts) & np.uint64(0x7F)).astype(np.uint8)
+    
+    # 每个数占用的字节数，除最后一个字节外都置续位
+    nbytes = 1 + (values[:, None] >= (np.uint64(1) << shifts[1:])).sum(axis=1)
+    used = np.arange(5) < nbytes[:, None]
+    groups[np.arange(5) < (nbytes - 1)[:, None]] |= 0x80
+    return groups[used].tobytes()
+
+def encode_ranges(starts, ends, country_idx):
+    """按 database.json 的 data 格式编码已排序的区间 (格式见文件顶部说明)"""
+    b64 = lambda raw: base64.b64encode(raw).decode('ascii')
+    return {
+        "starts": b64(encode_varints(np.diff(starts, prepend=0))),
+        "lengths": b64(encode_varints(ends - starts)),
+        "countries": b64(country_idx.astype(np.uint8).tobytes()),
+    }
+
+def decode_varints(raw):
+    """encode_varints 的逆运算，返回 int64 数组"""
+    data = np.frombuffer(raw, dtype=np.uint8).astype(np.int64)
+    if len(data) == 0:
+        return data
+    # 不带续位的字节是每个数的最后一个字节
+    lasts = np.flatnonzero((data & 0x80) == 0)
+    firsts = np.concatenate(([0], lasts[:-1] + 1))
+    positions = np.arange(len(data)) - np.repeat(firsts, lasts - firsts + 1)
+    return np.add.reduceat((data & 0x7F) << (7 * positions), firsts)
+
+def decode_ranges(data, countries):
+    """
+    解码 database.json 的 data 字段 (encode_ranges 的逆运算)
+    countries 为 meta.countries，返回 [[start, end, code], ...]
+    """
+    starts = np.cumsum(decode_varints(base64.b64decode(data["starts"])))
+    ends = starts + decode_varints(base64.b64decode(data["lengths"]))
+    country_idx = np.frombuffer(base64.b64decode(data["countries"]), dtype=np.uint8)
+    return [
+        [s, e, countries[i]] for s, e, i in
+        zip(starts.tolist(), ends.tolist(), country_idx.tolist())
+    ]
+
+def flatten_ranges(entries, country_table):
+    """
+    将可能重叠的合并区间拍平为互不重叠的分段
+    重叠时层级高者优先 (1 > 2 > 3)，同层级内较窄的区间优先
+    返回 (seg_starts, seg_values)，seg_values 为 country_table 下标+1，0 表示未知
+    """
+    tier_of = {c: 1 for c in TIER1_COUNTRIES} | {c: 2 for c in TIER2_COUNTRIES}
+    value_of = {c: i + 1 for i, c in enumerate(country_table)}
+    # 先绘制优先级低的，后绘制的覆盖先绘制的
+    ordered = sorted(entries, key=lambda x: (-tier_of.get(x[2], 3), x[0] - x[1]))
+    starts = np.array([x[0] for x in ordered], dtype=np.int64)
+    ends = np.array([x[1] for x in ordered], dtype=np.int64)
+    values = [value_of[x[2]] for x in ordered]
+    
+    points = np.unique(np.concatenate(([0, 1 << 32], starts, ends + 1)))
+    seg_values = np.zeros(len(points) - 1, dtype=np.uint32)
+    lo = np.searchsorted(points, starts).tolist()
+    hi = np.searchsorted(points, ends + 1).tolist()
+    for l, h, v in zip(lo, hi, values):
+        seg_values[l:h] = v
+    
+    # 合并相邻同值分段
+    keep = np.empty(len(seg_values), dtype=bool)
+    keep[0] = True
+    keep[1:] = seg_values[1:] != seg_values[:-1]
+    return points[:-1][keep], seg_values[keep]
+
+def _branch_bits(boundaries, remaining):
+    """按块内边界数选择分支位数，使子槽位数略大于边界数"""
+    return min(remaining, TRIE_MAX_BRANCH, max(1, int(boundaries).bit_length()))
+
+def build_trie(seg_starts, seg_values):
+    """
+    由互不重叠的分段构建多分支查找树 (LC-trie 的简化形式，无路径跳跃)
+    每个节点按块内边界密度自适应选择分支位数，返回 (root_bits, slots)
+    """
+    root_bits = _branch_bits(len(seg_starts) - 1, 32)
+    chunks = []
+    total = 1 << root_bits
+    queue = deque([(0, 32, root_bits)])  # (块起始地址, 剩余位数, 分支位数)
+    
+    while queue:
+        base, remaining, bits = queue.popleft()
+        child_remaining = remaining - bits
+        child_starts = base + (np.arange(1 << bits, dtype=np.int64) << child_remaining)
+        child_ends = child_starts + ((1 << child_remaining) - 1)
+        lo = np.searchsorted(seg_starts, child_starts, side='right') - 1
+        hi = np.searchsorted(seg_starts, child_ends, side='right') - 1
         
-        if s - ce <= merge_threshold:
-            if e > ce:
-                ce = e
-        else:
-            merged.append((cs, ce))
-            cs, ce = s, e
+        # 块内无边界 -> 叶子；否则递归展开
+        slots = seg_values[lo] | np.uint32(TRIE_LEAF)
+        for j in np.flatnonzero(hi != lo).tolist():
+            child_bits = _branch_bits(hi[j] - lo[j], child_remaining)
+            slots[j] = (child_bits << TRIE_BRANCH_SHIFT) | total
+            queue.append((int(child_starts[j]), child_remaining, child_bits))
+            total += 1 << child_bits
+        chunks.append(slots)
     
-    merged.append((cs, ce))
-    return merged
+    if total >= 1 << TRIE_BRANCH_SHIFT:
+        raise Exception(f"查找树过大: {total:,} 个槽位")
+    return root_bits, np.concatenate(chunks)
+
+def write_trie(path, country_table, root_bits, slots):
+    """写出 database.trie.bin (格式见文件顶部说明)"""
+    header = TRIE_MAGIC + bytes([root_bits, len(country_table), 0, 0])
+    header += ''.join(country_table).encode('ascii')
+    header += b'\0' * (-len(header) % 4)
+    with open(path, 'wb') as f:
+        f.write(header)
+        f.write(slots.astype('<u4').tobytes())
+
+def write_mmdb(path, country_table, seg_starts, seg_values):
+    """将不重叠分段写为 MMDB 文件，记录结构与 GeoLite2-Country 的 country.iso_code 一致"""
+    writer = MMDBWriter(
+        ip_version=4,
+        database_type='Tiered-Country',
+        languages=['zh-CN'],
+        description='三级精度IP国家数据库',
+    )
+    seg_ends = np.append(seg_starts[1:] - 1, (1 << 32) - 1)
+    for value, country in enumerate(country_table, start=1):
+        mask = seg_values == value
+        if not mask.any():
+            continue
+        # IPSet 自动完成区间到 CIDR 前缀的拆分
+        network = IPSet(IPRange(s, e) for s, e in zip(seg_starts[mask].tolist(), seg_ends[mask].tolist()))
+        writer.insert_network(network, {'country': {'iso_code': country}})
+    writer.to_db_file(path)
 
 def main():
     print("=" * 60)
@@ -121,113 +338,100 @@ def main():
         print("❌ 错误：请先配置你的MaxMind许可证密钥")
         sys.exit(1)
     
-    # 清理并开始
-    if os.path.exists(TEMP_DIR):
-        shutil.rmtree(TEMP_DIR)
-    
     try:
         # 1. 下载
         # type: ignore
-        blocks_file, locations_file = download_and_extract()
+        archive = download_and_extract()
         
         # 2. 加载国家映射
         print("\n[2] 加载国家映射...")
-        country_map = {}
         try:
-            with open(locations_file, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    country_map[row['geoname_id']] = row['country_iso_code']
+            with open_member(archive, "GeoLite2-Country-Locations-zh-CN.csv") as f:
+                country_map = load_country_map(f)
         except:
-            eng_file = locations_file.replace('zh-CN', 'en')
-            with open(eng_file, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    country_map[row['geoname_id']] = row['country_iso_code']
+            with open_member(archive, "GeoLite2-Country-Locations-en.csv") as f:
+                country_map = load_country_map(f)
+        
+        # geoname_id -> 最终分组下标 (第三层级统一为 'ZZ') 的查找数组，每行一次取值即可定级
+        bucket_of = {c: i for i, c in enumerate(COUNTRY_TABLE)}
+        bucket_by_id = np.full(max(int(gid) for gid in country_map) + 1, -1, dtype=np.int8)
+        for gid, iso in country_map.items():
+            if iso:
+                bucket_by_id[int(gid)] = bucket_of.get(iso, bucket_of[OTHER_COUNTRY_CODE])
         
         # 3. 按三级分类收集数据
         print("[3] 分类收集IP段数据...")
-        tier1_data = {c: [] for c in TIER1_COUNTRIES}
-        tier2_data = {c: [] for c in TIER2_COUNTRIES}
-        tier3_data = []  # 其他国家
+        with open_member(archive, "GeoLite2-Country-Blocks-IPv4.csv") as f:
+            starts, ends, country_idx = load_blocks(f, bucket_by_id)
+        archive.close()
+        print(f"    已处理 {len(starts):,} 个有效IP段")
         
-        with open(blocks_file, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for i, row in enumerate(reader):
-                if i % 200000 == 0 and i > 0:
-                    print(f"    已处理 {i:,} 行...")
-                
-                geoname_id = row.get('registered_country_geoname_id') or row.get('geoname_id')
-                country = country_map.get(geoname_id, '')  # 如果找不到，默认为空字符串
-                if not country:
-                    continue
-                
-                try:
-                    net = ip_network(row['network'].strip())
-                    start, end = int(net.network_address), int(net.broadcast_address)
-                    
-                    if country in TIER1_COUNTRIES:
-                        tier1_data[country].append((start, end))
-                    elif country in TIER2_COUNTRIES:
-                        tier2_data[country].append((start, end))
-                    else:
-                        tier3_data.append((start, end))
-                except:
-                    continue
+        # 按 (国家, 起始地址) 一次性排序，之后每个国家对应一段连续区域
+        # MaxMind 数据本身已按地址升序，此时只需按国家稳定排序 (int8 键为线性时间的基数排序)
+        if np.all(starts[:-1] <= starts[1:]):
+            order = np.argsort(country_idx, kind='stable')
+        else:
+            order = np.lexsort((starts, country_idx))
+        starts, ends, country_idx = starts[order], ends[order], country_idx[order]
         
-        # 4. 三级差异化合并
+        # 4. 三级差异化合并 (所有国家一次扫描完成)
         print("\n[4] 执行三级差异化合并...")
-        all_entries = []
+        tier_levels = [
+            1 if c in TIER1_COUNTRIES else 2 if c in TIER2_COUNTRIES else 3
+            for c in COUNTRY_TABLE
+        ]
+        thresholds = np.array([MERGE_THRESHOLDS[t] for t in tier_levels], dtype=np.int64)
+        merged_starts, merged_ends, merged_idx = tiered_merge_ranges(starts, ends, country_idx, thresholds)
+        
+        before = dict(zip(COUNTRY_TABLE, np.bincount(country_idx, minlength=len(COUNTRY_TABLE)).tolist()))
+        after = dict(zip(COUNTRY_TABLE, np.bincount(merged_idx, minlength=len(COUNTRY_TABLE)).tolist()))
         
         # 4.1 第一层级：核心8国 (高精度)
         print("    第一层级 (核心8国 - 高精度):")
         for country in sorted(TIER1_COUNTRIES):
-            ranges = tier1_data[country]
-            if not ranges:
-                continue
-            merged = tiered_merge_ranges(ranges, tier_level=1)
-            for s, e in merged:
-                all_entries.append([s, e, country])
-            print(f"        {country}: {len(ranges):,} -> {len(merged):,} 区间")
+            if before[country]:
+                print(f"        {country}: {before[country]:,} -> {after[country]:,} 区间")
         
         # 4.2 第二层级：次要10国 (中精度)
         print("    第二层级 (次要10国 - 中精度):")
         for country in sorted(TIER2_COUNTRIES):
-            ranges = tier2_data[country]
-            if not ranges:
-                continue
-            merged = tiered_merge_ranges(ranges, tier_level=2)
-            for s, e in merged:
-                all_entries.append([s, e, country])
-            print(f"        {country}: {len(ranges):,} -> {len(merged):,} 区间")
+            if before[country]:
+                print(f"        {country}: {before[country]:,} -> {after[country]:,} 区间")
         
         # 4.3 第三层级：其余所有 (低精度)
         print("    第三层级 (其余所有 - 低精度):")
-        if tier3_data:
-            merged = tiered_merge_ranges(tier3_data, tier_level=3)
-            for s, e in merged:
-                all_entries.append([s, e, OTHER_COUNTRY_CODE])
-            print(f"        其余国家: {len(tier3_data):,} -> {len(merged):,} 区间")
+        if before[OTHER_COUNTRY_CODE]:
+            print(f"        其余国家: {before[OTHER_COUNTRY_CODE]:,} -> {after[OTHER_COUNTRY_CODE]:,} 区间")
             print(f"        标记为: '{OTHER_COUNTRY_CODE}'")
         
         # 5. 排序并保存
         print("\n[5] 保存为优化JSON...")
-        all_entries.sort(key=lambda x: x[0])
+        order = np.argsort(merged_starts, kind='stable')
+        merged_starts, merged_ends, merged_idx = merged_starts[order], merged_ends[order], merged_idx[order]
+        all_entries = [
+            [s, e, COUNTRY_TABLE[i]] for s, e, i in
+            zip(merged_starts.tolist(), merged_ends.tolist(), merged_idx.tolist())
+        ]
         
         result = {
             "meta": {
-                "version": "three-tier-v1",
+                "version": "three-tier-v2",
                 "tier1": sorted(list(TIER1_COUNTRIES)),
                 "tier2": sorted(list(TIER2_COUNTRIES)),
                 "other": OTHER_COUNTRY_CODE,
+                "countries": COUNTRY_TABLE,
                 "generated": datetime.now(timezone.utc).strftime("%Y-%m-%d"),
                 "totalRanges": len(all_entries)
             },
-            "data": all_entries
+            "data": encode_ranges(merged_starts, merged_ends, merged_idx)
         }
         
-        with open(OUTPUT_JSON, 'w', encoding='utf-8') as f:
-            json.dump(result, f, separators=(',', ':'))
+        # 写出前解码一次，确认编码结果可还原为原始区间
+        if decode_ranges(result["data"], COUNTRY_TABLE) != all_entries:
+            raise Exception("区间数据编码校验失败")
+        
+        with open(OUTPUT_JSON, 'wb') as f:
+            f.write(orjson.dumps(result))
         
         size = os.path.getsize(OUTPUT_JSON)
         size_kb = size / 1024
@@ -236,7 +440,21 @@ def main():
         print(f"    最终区间总数: {len(all_entries):,}")
         print(f"    最终文件大小: {size_mb:.2f} MB ({size_kb:.1f} KB)")
         
-        # 6. 预期效果分析
+        # 6. 生成前端查找树
+        print("\n[6] 生成前端查找树...")
+        seg_starts, seg_values = flatten_ranges(all_entries, COUNTRY_TABLE)
+        root_bits, slots = build_trie(seg_starts, seg_values)
+        write_trie(OUTPUT_TRIE, COUNTRY_TABLE, root_bits, slots)
+        print(f"    不重叠分段: {len(seg_starts):,}")
+        print(f"    根节点分支: {root_bits} 位，槽位总数: {len(slots):,}")
+        print(f"    文件大小: {os.path.getsize(OUTPUT_TRIE) / 1024:.1f} KB")
+        
+        # 7. 生成MMDB
+        print("\n[7] 生成MMDB...")
+        write_mmdb(OUTPUT_MMDB, COUNTRY_TABLE, seg_starts, seg_values)
+        print(f"    文件大小: {os.path.getsize(OUTPUT_MMDB) / 1024:.1f} KB")
+        
+        # 8. 预期效果分析
         print("\n" + "=" * 60)
         print("✅ 三级精度数据库构建完成！")
         print("=" * 60)
@@ -249,7 +467,7 @@ def main():
         if size_mb > 1.2:
             print(f"\n⚠️  文件仍 >1.2MB，可考虑:")
             print(f"   1. 将第二层级国家移入第三层级 (改为'ZZ')")
-            print(f"   2. 在 tiered_merge_ranges() 中调整合并阈值")
+            print(f"   2. 调整 MERGE_THRESHOLDS 中的合并阈值")
         elif size_mb > 0.8:
             print(f"\n📈 大小适中 ({size_mb:.2f}MB)，适合异步加载")
         else:
@@ -264,8 +482,6 @@ def main():
         import traceback
         traceback.print_exc()
     finally:
-        if os.path.exists(TEMP_DIR):
-            shutil.rmtree(TEMP_DIR)
         print("=" * 60)
 
 if __name__ == "__main__":